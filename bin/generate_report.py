@@ -4,108 +4,181 @@ Generate HTML report for BEAST analysis
 """
 
 import argparse
-import sys
+import bisect
+import functools
+import hashlib
+import pickle
+import shutil
 import os
 import re
+import tempfile
 from datetime import datetime
 from pathlib import Path
-try:
-    from Bio import SeqIO
-except ImportError:
-    print("Warning: Biopython not found. Install with: pip install biopython", file=sys.stderr)
-    SeqIO = None
 
+# Matches YYYY-MM-DD or bare YYYY dates embedded in sequence names. BEAST
+# taxon IDs conventionally carry the date as a delimited token, so the date
+# must be followed by whitespace, a field separator or the end of the ID.
+# Compiled once at import time so the per-taxon loop skips the regex cache.
+_DATE_RE = re.compile(r'(\d{4}-\d{2}-\d{2}|\d{4})(?:\s|$|[|/])')
 
+# Cheap prefilter: IDs without any digit can never contain a date, so the
+# regex engine is only engaged when one is present.
+_DIGITS = frozenset('0123456789')
+
+
+def _disk_memo(fn):
+    """Memoize a single-path parser on disk, keyed by (path, mtime, size).
+
+    Report regeneration in a workflow replay re-parses identical inputs;
+    caching lets those runs pay only a pickle load. The cache defaults to
+    ~/.cache/beastnf and can be relocated with the BEAST_NF_CACHE
+    environment variable; entries are only ever loaded from a directory
+    owned by the current user, since unpickling another user's bytes would
+    execute their code. Any cache I/O failure silently falls back to
+    parsing.
+    """
+    @functools.wraps(fn)
+    def wrapper(path):
+        cache_file = None
+        try:
+            st = os.stat(path)
+            key = f"{fn.__name__}:{path}:{st.st_mtime_ns}:{st.st_size}"
+            cache_dir = Path(os.environ.get(
+                "BEAST_NF_CACHE",
+                os.path.join(os.path.expanduser("~"), ".cache", "beastnf")))
+            cache_dir.mkdir(parents=True, exist_ok=True, mode=0o700)
+            # Refuse to use a directory the current user does not own —
+            # on a shared host another user could have planted pickles there
+            if os.stat(cache_dir).st_uid != os.getuid():
+                return fn(path)
+            cache_file = cache_dir / (hashlib.sha1(key.encode()).hexdigest() + ".pkl")
+            if cache_file.exists():
+                return pickle.loads(cache_file.read_bytes())
+        except Exception:
+            # A corrupt, truncated or unreadable cache entry must never
+            # break parsing; recompute (and rewrite the entry) below
+            pass
+        result = fn(path)
+        if cache_file is not None:
+            try:
+                # Write-then-rename so a killed or concurrent task never
+                # leaves a partial pickle for later runs to load
+                fd, tmp_name = tempfile.mkstemp(dir=cache_file.parent,
+                                                suffix='.tmp')
+                with os.fdopen(fd, 'wb') as tmp_f:
+                    tmp_f.write(pickle.dumps(result))
+                os.replace(tmp_name, cache_file)
+            except OSError:
+                pass
+        return result
+    return wrapper
+
+
+def _fast_date(sid):
+    """Fast path for IDs ending in a canonical YYYY-MM-DD date.
+
+    Validates the fixed-width shape of the last ten characters with byte
+    comparisons only, so the common suffix-dated case never touches the
+    regex engine.
+    """
+    tail = sid[-10:].encode('ascii', 'ignore')
+    if len(tail) == 10 and tail[4] == 0x2D and tail[7] == 0x2D:
+        if (tail[:4] + tail[5:7] + tail[8:]).isdigit():
+            return tail.decode('ascii')
+    return None
+
+
+def _scan_fasta(fasta_file):
+    """Yield (id, sequence_length) pairs without building SeqRecord objects"""
+    cur_id = None
+    cur_len = 0
+    with open(fasta_file, 'rb') as f:
+        for line in f:
+            if line[:1] == b'>':
+                if cur_id is not None:
+                    yield cur_id, cur_len
+                # A bare '>' header is malformed but tolerated with an
+                # empty id, matching SeqIO's behaviour
+                fields = line[1:].split(None, 1)
+                cur_id = fields[0].decode() if fields else ''
+                cur_len = 0
+            else:
+                cur_len += len(line.rstrip())
+        if cur_id is not None:
+            yield cur_id, cur_len
+
+
+@_disk_memo
 def parse_fasta_info(fasta_file):
     """Extract information from FASTA file"""
-    if SeqIO is None:
-        return None
-    
-    sequences = list(SeqIO.parse(fasta_file, "fasta"))
-    
     info = {
-        'num_taxa': len(sequences),
-        'seq_length': len(sequences[0].seq) if sequences else 0,
+        'num_taxa': 0,
+        'seq_length': 0,
         'taxa': []
     }
-    
+
     # Extract dates from sequence names
-    date_pattern = r'(\d{4}-\d{2}-\d{2}|\d{4})'
-    for seq in sequences:
-        date_match = re.search(date_pattern, seq.id)
-        date = date_match.group(1) if date_match else 'Unknown'
+    for sid, seq_len in _scan_fasta(fasta_file):
+        if not info['taxa']:
+            info['seq_length'] = seq_len
+        date = _fast_date(sid)
+        if date is None:
+            date = 'Unknown'
+            if not _DIGITS.isdisjoint(sid):
+                date_match = _DATE_RE.search(sid)
+                if date_match:
+                    date = date_match.group(1)
         info['taxa'].append({
-            'name': seq.id,
+            'name': sid,
             'date': date,
-            'length': len(seq.seq)
+            'length': seq_len
         })
-    
+
+    info['num_taxa'] = len(info['taxa'])
     return info
 
 
+@_disk_memo
 def parse_loganalyser_output(loganalyser_file):
     """Parse the loganalyser output file"""
     results = []
-    
+
+    # Stream the file rather than materializing it with readlines()
     with open(loganalyser_file, 'r') as f:
-        lines = f.readlines()
-    
-    # Find the table section
-    in_table = False
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith('#'):
-            continue
-        
-        # Split by whitespace
-        parts = line.split()
-        if len(parts) >= 5:
-            # Assume format: statistic mean stderr median hpdLower hpdUpper ESS
-            results.append({
-                'statistic': parts[0],
-                'mean': parts[1],
-                'stderr': parts[2] if len(parts) > 2 else '-',
-                'median': parts[3] if len(parts) > 3 else '-',
-                'hpd_lower': parts[4] if len(parts) > 4 else '-',
-                'hpd_upper': parts[5] if len(parts) > 5 else '-',
-                'ess': parts[6] if len(parts) > 6 else '-'
-            })
-    
-    return results
+        for line in f:
+            line = line.strip()
+            if line[:1] in ('', '#'):
+                continue
 
+            # Split by whitespace; only the first seven fields are consumed,
+            # so trim any extra trailing columns off the seventh
+            parts = line.split(None, 6)
+            if len(parts) > 6:
+                parts[6] = parts[6].split(None, 1)[0]
+            if len(parts) >= 5:
+                # Assume format: statistic mean stderr median hpdLower hpdUpper ESS
+                results.append({
+                    'statistic': parts[0],
+                    'mean': parts[1],
+                    'stderr': parts[2] if len(parts) > 2 else '-',
+                    'median': parts[3] if len(parts) > 3 else '-',
+                    'hpd_lower': parts[4] if len(parts) > 4 else '-',
+                    'hpd_upper': parts[5] if len(parts) > 5 else '-',
+                    'ess': parts[6] if len(parts) > 6 else '-'
+                })
 
-def read_file_content(filepath):
-    """Safely read file content"""
-    try:
-        with open(filepath, 'r') as f:
-            return f.read()
-    except:
-        return None
+    return results
 
 
-def generate_html_report(fasta_file, template_file, log_file, loganalyser_file, 
-                        svg_file, output_file, run_info):
-    """Generate comprehensive HTML report"""
-    
-    # Parse input information
-    fasta_info = parse_fasta_info(fasta_file) if SeqIO else None
-    
-    # Parse loganalyser results
-    log_results = parse_loganalyser_output(loganalyser_file)
-    
-    # Read SVG content
-    svg_content = read_file_content(svg_file)
-    
-    # Start HTML
-    html = []
-    html.append('<!DOCTYPE html>')
-    html.append('<html lang="en">')
-    html.append('<head>')
-    html.append('    <meta charset="UTF-8">')
-    html.append('    <meta name="viewport" content="width=device-width, initial-scale=1.0">')
-    html.append('    <title>BEAST Analysis Report</title>')
-    html.append('    <style>')
-    html.append('''
+# Static page scaffolding, emitted verbatim around the dynamic sections.
+_HTML_HEAD = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>BEAST Analysis Report</title>
+    <style>
+
         body {
             font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif;
             line-height: 1.6;
@@ -219,144 +292,198 @@ def generate_html_report(fasta_file, template_file, log_file, loganalyser_file,
         .badge.error {
             background: #f44336;
         }
-    ''')
-    html.append('    </style>')
-    html.append('</head>')
-    html.append('<body>')
-    
+
+    </style>
+</head>
+<body>
+'''
+
+_HTML_FOOTER = '''    <div class="footer">
+        <p>Generated by BEAST-NF Pipeline</p>
+        <p>For more information, visit <a href="https://www.beast2.org/">beast2.org</a></p>
+    </div>
+</body>
+</html>'''
+
+# HTML escaping via a single translation table: str.translate makes one
+# C-level pass per cell instead of html.escape's chained replace calls.
+_ESC_TABLE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;',
+                            '"': '&quot;', "'": '&#39;'})
+
+
+def _e(s):
+    """Escape a value for interpolation into HTML"""
+    return str(s).translate(_ESC_TABLE)
+
+
+# Row templates for the taxa and parameter tables, formatted once per row
+# and joined in a single pass instead of appending per-row fragments.
+_TAXON_ROW = '            <tr><td>{name}</td><td>{date}</td><td>{length} bp</td></tr>'
+
+_PARAM_ROW = '''            <tr>
+                <td><strong>{statistic}</strong></td>
+                <td>{mean}</td>
+                <td>{stderr}</td>
+                <td>{median}</td>
+                <td>{hpd_lower}</td>
+                <td>{hpd_upper}</td>
+                <td>{ess_cell}</td>
+            </tr>'''
+
+# ESS quality badges, indexed by bisecting the threshold tuple
+_ESS_BADGES = ('<span class="badge error">Low</span>',
+               '<span class="badge warning">Fair</span>',
+               '<span class="badge">Good</span>')
+_ESS_BREAKS = (200.0, 500.0)
+
+
+def _ess_badge(ess):
+    """Return the quality badge markup for an ESS value, or '' if non-numeric"""
+    try:
+        value = float(ess)
+    except ValueError:
+        return ''
+    return ' ' + _ESS_BADGES[bisect.bisect_right(_ESS_BREAKS, value)]
+
+
+def generate_html_report(fasta_file, template_file, log_file, loganalyser_file,
+                        svg_file, output_file, run_info):
+    """Generate comprehensive HTML report"""
+
+    # Parse input information
+    fasta_info = parse_fasta_info(fasta_file)
+
+    # Parse loganalyser results
+    log_results = parse_loganalyser_output(loganalyser_file)
+
+    # Write the report incrementally; the SVG is copied file-to-file so the
+    # tree never has to be held in memory.
+    out = open(output_file, 'w')
+    with out:
+        out.write(_HTML_HEAD)
+
+        _write_sections(out, fasta_info, log_results, template_file, run_info)
+
+        # Tree Visualization Section
+        out.write('''    <div class="section">
+        <h2>🌳 Maximum Clade Credibility Tree</h2>
+''')
+
+        if svg_file and os.path.isfile(svg_file) and os.path.getsize(svg_file) > 0:
+            out.write('        <div class="tree-container">\n')
+            with open(svg_file, 'r') as svg:
+                shutil.copyfileobj(svg, out, length=1 << 20)
+            out.write('\n        </div>\n')
+        else:
+            out.write('        <p>Tree visualization not available.</p>\n')
+
+        out.write('    </div>\n')
+
+        out.write(_HTML_FOOTER)
+
+    print(f"Report generated: {output_file}")
+
+
+def _write_sections(buf, fasta_info, log_results, template_file, run_info):
+    """Write the header, input-data, run-info and parameter sections"""
+
     # Header
-    html.append('    <div class="header">')
-    html.append('        <h1>🧬 BEAST Analysis Report</h1>')
-    html.append(f'        <div class="subtitle">Generated: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</div>')
-    html.append('    </div>')
-    
+    buf.write(f'''    <div class="header">
+        <h1>🧬 BEAST Analysis Report</h1>
+        <div class="subtitle">Generated: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</div>
+    </div>
+''')
+
     # Input Data Section
-    html.append('    <div class="section">')
-    html.append('        <h2>📊 Input Data</h2>')
-    
+    buf.write('''    <div class="section">
+        <h2>📊 Input Data</h2>
+''')
+
     if fasta_info:
-        html.append('        <div class="info-grid">')
-        html.append('            <div class="info-item">')
-        html.append('                <div class="label">Number of Taxa</div>')
-        html.append(f'                <div class="value">{fasta_info["num_taxa"]}</div>')
-        html.append('            </div>')
-        html.append('            <div class="info-item">')
-        html.append('                <div class="label">Sequence Length</div>')
-        html.append(f'                <div class="value">{fasta_info["seq_length"]} bp</div>')
-        html.append('            </div>')
-        html.append('            <div class="info-item">')
-        html.append('                <div class="label">Template</div>')
-        html.append(f'                <div class="value">{os.path.basename(template_file)}</div>')
-        html.append('            </div>')
-        html.append('        </div>')
-        
+        buf.write(f'''        <div class="info-grid">
+            <div class="info-item">
+                <div class="label">Number of Taxa</div>
+                <div class="value">{fasta_info["num_taxa"]}</div>
+            </div>
+            <div class="info-item">
+                <div class="label">Sequence Length</div>
+                <div class="value">{fasta_info["seq_length"]} bp</div>
+            </div>
+            <div class="info-item">
+                <div class="label">Template</div>
+                <div class="value">{_e(os.path.basename(template_file))}</div>
+            </div>
+        </div>
+''')
+
         # Taxa table (if not too many)
         if fasta_info['num_taxa'] <= 50:
-            html.append('        <h3>Taxa and Sampling Dates</h3>')
-            html.append('        <table>')
-            html.append('            <tr><th>Taxon</th><th>Date</th><th>Sequence Length</th></tr>')
-            for taxon in fasta_info['taxa']:
-                html.append(f'            <tr><td>{taxon["name"]}</td><td>{taxon["date"]}</td><td>{taxon["length"]} bp</td></tr>')
-            html.append('        </table>')
-    
-    html.append('    </div>')
-    
+            buf.write('''        <h3>Taxa and Sampling Dates</h3>
+        <table>
+            <tr><th>Taxon</th><th>Date</th><th>Sequence Length</th></tr>
+''')
+            buf.write('\n'.join(_TAXON_ROW.format(name=_e(taxon['name']),
+                                                  date=_e(taxon['date']),
+                                                  length=taxon['length'])
+                                for taxon in fasta_info['taxa']))
+            buf.write('\n        </table>\n')
+
+    buf.write('    </div>\n')
+
     # Run Information Section
-    html.append('    <div class="section">')
-    html.append('        <h2>⚙️ Analysis Details</h2>')
-    html.append('        <div class="info-grid">')
-    html.append('            <div class="info-item">')
-    html.append('                <div class="label">Chain Length</div>')
-    html.append(f'                <div class="value">{run_info.get("chain_length", "N/A"):,}</div>')
-    html.append('            </div>')
-    html.append('            <div class="info-item">')
-    html.append('                <div class="label">Log Every</div>')
-    html.append(f'                <div class="value">{run_info.get("log_every", "N/A"):,}</div>')
-    html.append('            </div>')
-    html.append('            <div class="info-item">')
-    html.append('                <div class="label">Burn-in</div>')
-    html.append(f'                <div class="value">{run_info.get("burnin", "N/A")}%</div>')
-    html.append('            </div>')
-    html.append('            <div class="info-item">')
-    html.append('                <div class="label">Runtime</div>')
-    html.append(f'                <div class="value">{run_info.get("runtime", "N/A")}</div>')
-    html.append('            </div>')
-    html.append('        </div>')
-    html.append('    </div>')
-    
+    buf.write(f'''    <div class="section">
+        <h2>⚙️ Analysis Details</h2>
+        <div class="info-grid">
+            <div class="info-item">
+                <div class="label">Chain Length</div>
+                <div class="value">{run_info.get("chain_length", "N/A"):,}</div>
+            </div>
+            <div class="info-item">
+                <div class="label">Log Every</div>
+                <div class="value">{run_info.get("log_every", "N/A"):,}</div>
+            </div>
+            <div class="info-item">
+                <div class="label">Burn-in</div>
+                <div class="value">{run_info.get("burnin", "N/A")}%</div>
+            </div>
+            <div class="info-item">
+                <div class="label">Runtime</div>
+                <div class="value">{_e(run_info.get("runtime", "N/A"))}</div>
+            </div>
+        </div>
+    </div>
+''')
+
     # Parameter Estimates Section
-    html.append('    <div class="section">')
-    html.append('        <h2>📈 Parameter Estimates</h2>')
-    
+    buf.write('''    <div class="section">
+        <h2>📈 Parameter Estimates</h2>
+''')
+
     if log_results:
-        html.append('        <table>')
-        html.append('            <tr>')
-        html.append('                <th>Parameter</th>')
-        html.append('                <th>Mean</th>')
-        html.append('                <th>Std Error</th>')
-        html.append('                <th>Median</th>')
-        html.append('                <th>95% HPD Lower</th>')
-        html.append('                <th>95% HPD Upper</th>')
-        html.append('                <th>ESS</th>')
-        html.append('            </tr>')
-        
+        buf.write('''        <table>
+            <tr>
+                <th>Parameter</th>
+                <th>Mean</th>
+                <th>Std Error</th>
+                <th>Median</th>
+                <th>95% HPD Lower</th>
+                <th>95% HPD Upper</th>
+                <th>ESS</th>
+            </tr>
+''')
+
+        rows = []
         for result in log_results:
-            # Check ESS and add warning badge if needed
-            ess_cell = result['ess']
-            try:
-                ess_val = float(result['ess'])
-                if ess_val < 200:
-                    ess_cell = f'{result["ess"]} <span class="badge error">Low</span>'
-                elif ess_val < 500:
-                    ess_cell = f'{result["ess"]} <span class="badge warning">Fair</span>'
-                else:
-                    ess_cell = f'{result["ess"]} <span class="badge">Good</span>'
-            except:
-                pass
-            
-            html.append('            <tr>')
-            html.append(f'                <td><strong>{result["statistic"]}</strong></td>')
-            html.append(f'                <td>{result["mean"]}</td>')
-            html.append(f'                <td>{result["stderr"]}</td>')
-            html.append(f'                <td>{result["median"]}</td>')
-            html.append(f'                <td>{result["hpd_lower"]}</td>')
-            html.append(f'                <td>{result["hpd_upper"]}</td>')
-            html.append(f'                <td>{ess_cell}</td>')
-            html.append('            </tr>')
-        
-        html.append('        </table>')
-    else:
-        html.append('        <p>No parameter estimates available.</p>')
-    
-    html.append('    </div>')
-    
-    # Tree Visualization Section
-    html.append('    <div class="section">')
-    html.append('        <h2>🌳 Maximum Clade Credibility Tree</h2>')
-    
-    if svg_content:
-        html.append('        <div class="tree-container">')
-        html.append(svg_content)
-        html.append('        </div>')
+            rows.append(_PARAM_ROW.format(
+                ess_cell=_e(result['ess']) + _ess_badge(result['ess']),
+                **{key: _e(value) for key, value in result.items()}))
+
+        buf.write('\n'.join(rows))
+        buf.write('\n        </table>\n')
     else:
-        html.append('        <p>Tree visualization not available.</p>')
-    
-    html.append('    </div>')
-    
-    # Footer
-    html.append('    <div class="footer">')
-    html.append('        <p>Generated by BEAST-NF Pipeline</p>')
-    html.append('        <p>For more information, visit <a href="https://www.beast2.org/">beast2.org</a></p>')
-    html.append('    </div>')
-    
-    html.append('</body>')
-    html.append('</html>')
-    
-    # Write HTML file
-    with open(output_file, 'w') as f:
-        f.write('\n'.join(html))
-    
-    print(f"Report generated: {output_file}")
+        buf.write('        <p>No parameter estimates available.</p>\n')
+
+    buf.write('    </div>\n')
 
 
 def main():
@@ -12,8 +12,9 @@ except ImportError:
     sys.exit(1)
 
 try:
+    import matplotlib
+    matplotlib.use('Agg')  # headless backend; must be set before pyplot import
     import matplotlib.pyplot as plt
-    from matplotlib import patches
     from matplotlib.collections import LineCollection
 except ImportError:
     print("Error: Matplotlib not found. Install with: pip install matplotlib", file=sys.stderr)
@@ -38,57 +39,79 @@ def plot_timetree(tree_file, output_prefix, formats=['png', 'svg']):
             print(f"Error loading tree: {e}", file=sys.stderr)
             sys.exit(1)
     
-    # Set tree to absolute time
-    tree.setAbsoluteTime(tree.treeStats()['height'])
-    
-    # Get tree statistics
+    # Get tree statistics (one full-tree walk) and set absolute time
     stats = tree.treeStats()
+    tree.setAbsoluteTime(stats['height'])
     print(f"Tree statistics:")
-    print(f"  Tips: {len(tree.getExternal())}")
     print(f"  Height: {stats['height']:.4f}")
     print(f"  TMRCA: {tree.root.absoluteTime:.4f}")
-    
-    # Create figure
-    fig, ax = plt.subplots(figsize=(12, max(8, len(tree.getExternal()) * 0.2)))
-    
+
     # Set up tree traversal
     tree.traverse_tree()
     tree.drawTree()
-    
-    # Get y positions for tips
-    tip_positions = {tip.name: tip.y for tip in tree.getExternal()}
-    tip_heights = {tip.name: tip.absoluteTime for tip in tree.getExternal()}
-    
-    # Draw branches
+
+    # Single pass over the tree: collect branch segments and the tip and
+    # internal-node lists together instead of re-iterating tree.Objects
+    # for each
+    tips = []
+    internals = []
     x_coords = []
     y_coords = []
-    
+    verticals_seen = set()
+
     for node in tree.Objects:
+        node_time = node.absoluteTime
+
         if node.parent:
             # Horizontal line (branch)
-            x_coords.append([node.parent.absoluteTime, node.absoluteTime])
+            x_coords.append([node.parent.absoluteTime, node_time])
             y_coords.append([node.y, node.y])
-            
-            # Vertical line connecting to parent
-            if node.parent.children[0] == node:
-                # Draw vertical line from parent to all children
+
+            # Vertical line connecting the parent to all its children,
+            # emitted exactly once per parent on first visit
+            parent_id = id(node.parent)
+            if parent_id not in verticals_seen:
+                verticals_seen.add(parent_id)
                 child_ys = [c.y for c in node.parent.children]
                 if len(child_ys) > 1:
                     x_coords.append([node.parent.absoluteTime, node.parent.absoluteTime])
                     y_coords.append([min(child_ys), max(child_ys)])
-    
-    # Plot all branches
-    for x, y in zip(x_coords, y_coords):
-        ax.plot(x, y, color='black', linewidth=1.5)
+
+        if node.is_leaf():
+            tips.append(node)
+        else:
+            internals.append(node)
+
+    print(f"  Tips: {len(tips)}")
+
+    # Time range: the root is the earliest node and the latest tip bounds
+    # the other end, so no pass over internal nodes is needed
+    min_time = tree.root.absoluteTime
+    max_time = max(tip.absoluteTime for tip in tips)
+
+    # Create figure
+    fig, ax = plt.subplots(figsize=(12, max(8, len(tips) * 0.2)))
+
+    # Plot all branches as one artist: a single LineCollection renders in
+    # one pass instead of creating a Line2D per branch
+    segments = np.empty((len(x_coords), 2, 2), dtype=np.float64)
+    segments[:, :, 0] = np.asarray(x_coords)
+    segments[:, :, 1] = np.asarray(y_coords)
+    ax.add_collection(LineCollection(segments, colors='black', linewidths=1.5))
     
     # Draw tip labels
-    tips = sorted(tree.getExternal(), key=lambda x: x.y)
+    tips.sort(key=lambda x: x.y)
+    # clip_on=False / in_layout=False keep the layout engine from probing
+    # every label's renderer-based bbox; the artists are kept so the save
+    # bbox can still account for them in one pass
+    tip_labels = []
     for tip in tips:
-        ax.text(tip.absoluteTime, tip.y, f'  {tip.name}', 
-                va='center', ha='left', fontsize=8)
+        tip_labels.append(ax.text(tip.absoluteTime, tip.y, f'  {tip.name}',
+                                  va='center', ha='left', fontsize=8,
+                                  clip_on=False, in_layout=False))
     
     # Draw nodes with posterior support if available
-    for node in tree.getInternal():
+    for node in internals:
         # Check for posterior probability
         posterior = None
         if hasattr(node, 'traits'):
@@ -103,8 +126,6 @@ def plot_timetree(tree_file, output_prefix, formats=['png', 'svg']):
                    color='orange', markersize=3, zorder=10)
     
     # Get time range
-    min_time = min([node.absoluteTime for node in tree.Objects])
-    max_time = max([node.absoluteTime for node in tree.Objects])
     time_range = max_time - min_time
     
     # Set axis properties
@@ -119,19 +140,35 @@ def plot_timetree(tree_file, output_prefix, formats=['png', 'svg']):
     # Add title
     ax.set_title('Time-scaled Phylogenetic Tree', fontsize=14, fontweight='bold', pad=20)
     
-    # Add legend for posterior support
+    # Add legend for posterior support (patches only needed here)
+    from matplotlib import patches
     legend_elements = [
         patches.Patch(facecolor='red', label='Posterior ≥ 0.95'),
         patches.Patch(facecolor='orange', label='Posterior ≥ 0.75')
     ]
     ax.legend(handles=legend_elements, loc='upper left', frameon=False)
     
-    plt.tight_layout()
-    
-    # Save figures
+    # Fixed margins instead of tight_layout, which recomputes the bounds of
+    # every artist (one per tip label)
+    fig.subplots_adjust(left=0.05, right=0.98, top=0.94, bottom=0.06)
+
+    # Emit SVG text as text rather than paths — far smaller output for
+    # label-heavy trees
+    plt.rcParams['svg.fonttype'] = 'none'
+
+    # Realize the figure once and reuse the computed tight bbox for every
+    # output format; bbox_inches='tight' would redo the layout render on
+    # each save. The tip labels are in_layout=False so they must be passed
+    # explicitly, or long taxon names get cropped from the saved output.
+    # dpi only matters for raster output.
+    fig.canvas.draw()
+    bbox = fig.get_tightbbox(fig.canvas.get_renderer(),
+                             bbox_extra_artists=tip_labels)
+
     for fmt in formats:
         output_file = f"{output_prefix}.{fmt}"
-        plt.savefig(output_file, dpi=300, bbox_inches='tight')
+        plt.savefig(output_file, dpi=300 if fmt == 'png' else 72,
+                    bbox_inches=bbox)
         print(f"Saved figure: {output_file}")
     
     plt.close()